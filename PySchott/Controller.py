@@ -0,0 +1,229 @@
+"""
+Closed-loop intensity stabilization of the MCLS Schott light sources
+"""
+import threading
+import time
+import numpy as np
+from .Status import parse_reply
+
+
+class IntensityController(object):
+    """
+    PID loop holding a feedback signal constant by driving the 11-bit
+    precise intensity of a MCLS light source, with a feed-forward term
+    compensating the drift of the LED output with the heatsink temperature.
+
+    The loop runs at a fixed rate in its own thread (see start and stop).
+    Each iteration reads the heatsink temperature, and the rear analog input
+    when it is used as feedback, in a single batch of queries.
+    """
+    def __init__(self, light, setpoint, feedback = None,
+                 kp = 0.002, ki = 0.001, kd = 0., feedforward = 0.,
+                 rate = 5., output_limits = (0.01, 1.)):
+        """
+        Intensity controller creator
+
+        Parameters
+        ----------
+        light : MCLS_Light
+            light source to be controlled
+        setpoint : float
+            target value of the feedback signal
+        feedback : callable, optional
+            function returning the feedback signal (e.g. the mean of a camera image).
+            If None, the rear analog input (in % of full scale) is used.
+        kp, ki, kd : float
+            proportional, integral (per second) and derivative (seconds) gains,
+            in intensity (0-1) per unit of feedback signal
+        feedforward : float
+            intensity correction per °C of heatsink temperature above its value
+            when the loop was started
+        rate : float
+            loop frequency in Hz
+        output_limits : tuple of floats
+            lowest and highest intensity (0-1) the loop may command
+        """
+        self.light = light
+        self.setpoint = setpoint
+        self.feedback = feedback
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.feedforward = feedforward
+        self.rate = rate
+        self.output_limits = output_limits
+        self._thread = None
+        self._stop = threading.Event()
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the loop state and the metrics.
+        The current intensity is taken as the starting output.
+        """
+        self.output = None
+        self.base_output = None
+        self.reference_temperature = None
+        self._integral = 0.
+        self._last_measurement = None
+        self._last_time = None
+        self._initial_sign = 0.
+        self._crossed = False
+        self.iterations = 0
+        self.read_errors = 0
+        self.errors = 0
+        self.last_error = None
+        self.overruns = 0
+        self.overshoot = 0.
+        self._periods = [0, 0., 0., 0.] # count, sum, sum of squares, max
+
+    def read(self):
+        """
+        Read the feedback signal and the heatsink temperature.
+
+        Returns
+        -------
+        measurement : float
+            feedback signal
+        T_C : float
+            heatsink temperature in °C
+        """
+        if self.feedback is None:
+            answers = self.light.query_many(['A1?', 'LT?'])
+            return parse_reply('A1?', answers[0]), parse_reply('LT?', answers[1])
+        T_C = self.light.LED_heatsink_temperature
+        return self.feedback(), T_C
+
+    def step(self):
+        """
+        Run a single iteration of the loop: read, compute and send the new intensity.
+
+        Returns
+        -------
+        output : float or None
+            intensity sent to the light source (None if the reading failed)
+        """
+        try:
+            measurement, T_C = self.read()
+            if self.base_output is None:
+                self.base_output = self.light.precise_intensity
+                self.reference_temperature = T_C
+        except ValueError:
+            self.read_errors += 1
+            return None
+        t = time.monotonic()
+        error = self.setpoint - measurement
+        self._update_overshoot(error)
+
+        dt = 0. if self._last_time is None else t - self._last_time
+        derivative = 0.
+        if dt > 0:
+            derivative = -(measurement - self._last_measurement)/dt
+        low, high = self.output_limits
+        feedforward = self.feedforward*(T_C - self.reference_temperature)
+        output = (self.base_output + feedforward + self.kp*error
+                  + self.ki*(self._integral + error*dt) + self.kd*derivative)
+        # the integral is only accumulated when the output is not saturated (anti-windup)
+        if low < output < high:
+            self._integral += error*dt
+        output = float(np.clip(output, low, high))
+
+        self.light.set_precise_intensity(output)
+        self.output = output
+        self._last_measurement = measurement
+        self._last_time = t
+        self.iterations += 1
+        return output
+
+    def _update_overshoot(self, error):
+        if self._initial_sign == 0.:
+            self._initial_sign = np.sign(error)
+            return
+        if not self._crossed and np.sign(error) != self._initial_sign:
+            self._crossed = True
+        if self._crossed:
+            overshoot = -self._initial_sign*error/abs(self.setpoint) if self.setpoint else 0.
+            self.overshoot = max(self.overshoot, overshoot)
+
+    def _run(self):
+        period = 1/self.rate
+        deadline = time.monotonic()
+        last = None
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if last is not None:
+                p = now - last
+                self._periods[0] += 1
+                self._periods[1] += p
+                self._periods[2] += p*p
+                self._periods[3] = max(self._periods[3], p)
+            last = now
+            try:
+                self.step()
+            except Exception as e:
+                # e.g. a serial error during a USB drop or a failing feedback callback:
+                # the loop keeps running, the error is counted and kept in last_error
+                self.errors += 1
+                self.last_error = e
+            deadline += period
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                # iteration longer than the period: skip the missed deadlines
+                self.overruns += 1
+                deadline = time.monotonic()
+            else:
+                self._stop.wait(delay)
+
+    def start(self):
+        """
+        Start the loop in a background thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the loop. The last intensity is kept.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self):
+        """
+        True if the loop thread is running
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def metrics(self):
+        """
+        Loop timing and regulation metrics.
+
+        Returns
+        -------
+        metrics : dict
+            iterations, read_errors (unreadable replies), errors (other exceptions
+            raised by an iteration, the last one being kept in last_error),
+            overruns (iterations longer than the period),
+            period_mean, period_std and period_max in seconds,
+            overshoot as a fraction of the setpoint
+        """
+        n, s, s2, p_max = self._periods
+        mean = s/n if n else 0.
+        std = np.sqrt(max(s2/n - mean*mean, 0.)) if n else 0.
+        return {'iterations': self.iterations,
+                'read_errors': self.read_errors,
+                'errors': self.errors,
+                'last_error': repr(self.last_error) if self.last_error is not None else None,
+                'overruns': self.overruns,
+                'period_mean': mean,
+                'period_std': float(std),
+                'period_max': p_max,
+                'overshoot': float(self.overshoot),
+                }
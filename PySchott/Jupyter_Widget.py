@@ -0,0 +1,130 @@
+"""
+Non blocking Jupyter control panel of the MCLS Schott light sources
+"""
+import asyncio
+import threading
+import ipywidgets as widgets
+from IPython.display import display
+
+
+class LightPanel(object):
+    """
+    Non blocking control panel of a MCLS light source for Jupyter notebooks.
+
+    Button and slider changes are coalesced and sent by a background thread,
+    so only the latest intensity is written when the slider moves faster than
+    the serial link. The telemetry readout is refreshed by a task running on
+    the kernel event loop, so other cells can be executed meanwhile.
+    """
+    def __init__(self, light, period = 1., verbose = False):
+        """
+        Control panel creator
+
+        Parameters
+        ----------
+        light : MCLS_Light
+            light source to be controlled
+        period : float
+            telemetry refresh period in seconds
+        verbose : bool
+            print the errors raised by the light source
+
+        Raises
+        ------
+        RuntimeError
+            if no asyncio event loop is running, the panel must be created from a
+            notebook cell (the IPython kernel runs its event loop) or a coroutine
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            raise RuntimeError('LightPanel needs a running asyncio event loop, '
+                               'create it from a notebook cell') from None
+        self.light = light
+        self.period = period
+        self.verbose = verbose
+        self._pending = {} # latest value of each pending command
+        self._cv = threading.Condition()
+        self._closed = False
+
+        self.onoff_button = widgets.ToggleButton(value=False, description='Set On')
+        self.intensity_slider = widgets.FloatSlider(value=0.05, min=0.001, max=1., step=0.001,
+                                                    description='Intensity',
+                                                    readout_format='.3f',
+                                                    continuous_update=True)
+        self.telemetry = widgets.HTML()
+        self.onoff_button.observe(self.ClickOnOff, names='value')
+        self.intensity_slider.observe(self.SetIntensity, names='value')
+        self.box = widgets.VBox([self.onoff_button, self.intensity_slider, self.telemetry])
+
+        self._worker = threading.Thread(target=self._send, daemon=True)
+        self._worker.start()
+        self._task = loop.create_task(self._update_telemetry())
+
+    def _ipython_display_(self):
+        display(self.box)
+
+    def _post(self, key, value):
+        with self._cv:
+            self._pending[key] = value
+            self._cv.notify()
+
+    def ClickOnOff(self, change):
+        if change['new']:
+            self.onoff_button.description = 'Set Off'
+            self._post('output', True)
+            self._post('intensity', self.intensity_slider.value)
+        else:
+            self.onoff_button.description = 'Set On'
+            self._post('output', False)
+
+    def SetIntensity(self, change):
+        self._post('intensity', change['new'])
+
+    def _send(self):
+        while True:
+            with self._cv:
+                while not self._pending and not self._closed:
+                    self._cv.wait()
+                if self._closed:
+                    return
+                pending = self._pending
+                self._pending = {}
+            try:
+                if pending.get('output') is True:
+                    self.light.set_on()
+                if 'intensity' in pending:
+                    self.light.set_precise_intensity(pending['intensity'])
+                if pending.get('output') is False:
+                    self.light.set_off()
+            except Exception as e:
+                if self.verbose:
+                    print(e)
+
+    async def _update_telemetry(self):
+        loop = asyncio.get_running_loop()
+        while not self._closed:
+            try:
+                status = await loop.run_in_executor(None, lambda: self.light.status)
+                self.telemetry.value = ('LED {} | intensity {:.3f} | heatsink {:.1f} °C | '
+                                        'board {:.1f} °C | fan {:.0f} RPM | control: {}'.format(
+                                            'on' if status.LED_output_enable else 'off',
+                                            status.precise_intensity,
+                                            status.LED_heatsink_temperature,
+                                            status.board_temperature,
+                                            status.fan_speed,
+                                            status.control_source.description))
+            except Exception as e:
+                self.telemetry.value = 'telemetry unavailable: {}'.format(e)
+            await asyncio.sleep(self.period)
+
+    def close(self):
+        """
+        Stop the background updates and close the widgets. The light is left as is.
+        """
+        with self._cv:
+            self._closed = True
+            self._cv.notify()
+        self._task.cancel()
+        self._worker.join()
+        self.box.close()
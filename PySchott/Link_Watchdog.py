@@ -0,0 +1,210 @@
+"""
+Link health watchdog of the MCLS Schott light sources
+"""
+import threading
+import time
+import serial
+import serial.tools.list_ports as list_ports
+import numpy as np
+from .Status import parse_reply, check_ack
+
+
+class Watchdog(object):
+    """
+    Detect the loss of the serial link of a light source and reconnect it.
+
+    The link is considered lost after max_errors consecutive timeouts or I/O
+    errors (see Light.consecutive_errors). The unit is then looked for by serial
+    number on the USB ports, its port is reopened, and the last intensity setpoint
+    and output state are restored.
+
+    The serial lock of the light source is held during the recovery, so the
+    queries of other threads wait for the new link instead of failing
+    one by one on the old one; the recovery gives up after max_recovery_time.
+    """
+    def __init__(self, light, period = 1., max_errors = 3, max_recovery_time = 10.,
+                 heartbeat = True, verbose = True):
+        """
+        Watchdog creator
+
+        Parameters
+        ----------
+        light : MCLS_Light
+            light source to be watched, it must be connected
+        period : float
+            time between two checks of the link in seconds
+        max_errors : int
+            number of consecutive errors after which the link is considered lost
+        max_recovery_time : float
+            longest time spent looking for the unit in a single recovery, in seconds
+        heartbeat : bool
+            query the output state at every check, so that the link loss is
+            detected even when the light source is not used
+        verbose : bool
+            print the recoveries
+        """
+        self.light = light
+        self.period = period
+        self.max_errors = max_errors
+        self.max_recovery_time = max_recovery_time
+        self.heartbeat = heartbeat
+        self.verbose = verbose
+        self.serial_number = light.serial_number
+        self.recovery_times = []
+        self.failures = 0
+        self.errors = 0
+        self.last_error = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def check(self):
+        """
+        Check the link, and recover it if it is lost.
+
+        Returns
+        -------
+        ok : bool
+            True if the link is up (possibly after a recovery)
+        """
+        if self.heartbeat and self.light.consecutive_errors < self.max_errors:
+            try:
+                self.light.query('L?')
+            except (serial.SerialException, OSError):
+                pass
+        if self.light.consecutive_errors < self.max_errors:
+            return True
+        return self.recover()
+
+    def _probe(self, port):
+        # open a port and check that the unit with the right serial number answers
+        try:
+            ser = self.light.open_serial(port)
+        except (serial.SerialException, OSError):
+            return None
+        try:
+            ser.reset_input_buffer()
+            ser.write(self.light.encode('Z'))
+            terminator = bytes(self.light.terminator, 'ascii')
+            answer = ser.read_until(terminator).rstrip(terminator).decode('ascii')
+            if parse_reply('Z', answer) == self.serial_number:
+                return ser
+        except (serial.SerialException, OSError, ValueError, UnicodeDecodeError):
+            pass
+        ser.close()
+        return None
+
+    def _candidates(self, last_port):
+        ports = [x.device for x in list_ports.comports() if x.hwid[:3] == 'USB']
+        # the adapter often comes back under the same name
+        if last_port in ports:
+            ports.remove(last_port)
+            ports.insert(0, last_port)
+        return ports
+
+    def _restore(self):
+        # every command is acknowledged, its reply is read before the next one
+        light = self.light
+        commands = []
+        if light.setpoint is not None:
+            commands.append('IP' + hex(int(round(light.setpoint*2047))))
+        if light.on is not None:
+            commands.append('L1' if light.on else 'L0')
+        for command in commands:
+            light.write(command)
+            check_ack(command, light.read())
+
+    def recover(self):
+        """
+        Reconnect the unit and restore its setpoint and output state.
+
+        Returns
+        -------
+        ok : bool
+            True if the unit was found before max_recovery_time
+        """
+        light = self.light
+        start = time.monotonic()
+        deadline = start + self.max_recovery_time
+        with light.lock:
+            last_port = light.ser.port
+            try:
+                light.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+            while time.monotonic() < deadline:
+                for port in self._candidates(last_port):
+                    ser = self._probe(port)
+                    if ser is not None:
+                        light.ser = ser
+                        light.consecutive_errors = 0
+                        try:
+                            self._restore()
+                        except (serial.SerialException, OSError, ValueError):
+                            # lost again or not acknowledged: close it before probing again
+                            try:
+                                ser.close()
+                            except (serial.SerialException, OSError):
+                                pass
+                            break
+                        duration = time.monotonic() - start
+                        self.recovery_times.append(duration)
+                        if self.verbose:
+                            print('light reconnected on {} in {:.2f} s'.format(port, duration))
+                        return True
+                    if time.monotonic() > deadline:
+                        break
+                time.sleep(0.1)
+        self.failures += 1
+        if self.verbose:
+            print('light not found after {:.1f} s'.format(self.max_recovery_time))
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.period):
+            try:
+                self.check()
+            except Exception as e:
+                # e.g. the RuntimeError of a stopped command scheduler: keep watching
+                self.errors += 1
+                self.last_error = e
+
+    def start(self):
+        """
+        Check the link periodically in a background thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background checks.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def metrics(self):
+        """
+        Recovery metrics.
+
+        Returns
+        -------
+        metrics : dict
+            recoveries, failures (recoveries given up after max_recovery_time),
+            last, mean and max recovery time in seconds, errors (exceptions
+            raised by the background checks, the last one being kept in last_error)
+        """
+        times = np.array(self.recovery_times)
+        return {'recoveries': len(times),
+                'failures': self.failures,
+                'recovery_time_last': float(times[-1]) if len(times) else None,
+                'recovery_time_mean': float(times.mean()) if len(times) else None,
+                'recovery_time_max': float(times.max()) if len(times) else None,
+                'errors': self.errors,
+                'last_error': repr(self.last_error) if self.last_error is not None else None,
+                }
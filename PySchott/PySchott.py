@@ -2,12 +2,18 @@ import serial
 import threading
 import numpy as np
 import serial.tools.list_ports as list_ports
+from .Status import MCLS_Status, parse_reply, check_ack, queries
+from .Sweep import sweep_commands, new_sweep, pending
+from .Scheduler import CommandScheduler
 
 class Light(object):
     """
     General Light class with basic functions to communicate with the controller 
     """
     ser = None
+    lock = None
+    scheduler = None
+    consecutive_errors = 0
     start = None
     terminator = None
     baudrate = 9600
@@ -30,18 +36,39 @@ class Light(object):
             self.connect(port)
             
     def connect(self, port): 
-        self.lock = threading.Lock()
-        self.ser = serial.Serial(port=port,
-                                baudrate=self.baudrate,
-                                bytesize=self.bytesize,
-                                stopbits = self.stopbits,
-                                timeout=self.timeout,
-                                parity=self.parity,
-                                )
+        if self.lock is None:
+            self.lock = threading.Lock()
+        self.ser = self.open_serial(port)
+        self.consecutive_errors = 0
+
+    def open_serial(self, port):
+        """
+        Open a serial port with the communication settings of the controller.
+
+        Parameters
+        ----------
+        port : string
+            port to be opened
+
+        Returns
+        -------
+        ser : serial.Serial
+            opened serial port
+        """
+        ser = serial.Serial(port=port,
+                            baudrate=self.baudrate,
+                            bytesize=self.bytesize,
+                            stopbits = self.stopbits,
+                            timeout=self.timeout,
+                            parity=self.parity,
+                            )
+        return ser
 
     def read(self):
         """
-        Serial read
+        Serial read of a single reply, up to the terminator.
+        Timeouts (empty answers) and I/O errors are counted in consecutive_errors,
+        which is reset by any successful read.
 
         Returns
         -------
@@ -49,10 +76,38 @@ class Light(object):
             string read from the controller
 
         """
-        string = self.ser.readline()
-        answer = string[0:-1].decode('ascii')
+        terminator = bytes(self.terminator, 'ascii')
+        try:
+            string = self.ser.read_until(terminator)
+        except serial.SerialException:
+            self.consecutive_errors += 1
+            raise
+        if string.endswith(terminator):
+            string = string[0:-1]
+        answer = string.decode('ascii')
+        if answer:
+            self.consecutive_errors = 0
+        else:
+            self.consecutive_errors += 1
         return answer
 
+    def encode(self, command):
+        """
+        Frame a command with the start and terminator characters.
+
+        Parameters
+        ----------
+        command : string
+            command to be written in the controller.
+
+        Returns
+        -------
+        input_bytes : bytes
+            bytes to be written on the serial port
+        """
+        input_bytes = bytes(self.start + command + self.terminator, 'ascii')
+        return input_bytes
+
     def write(self, command):
         """
         Serial write.
@@ -63,12 +118,17 @@ class Light(object):
             command to be written in the controller.
         """
         
-        input_bytes = bytes(self.start + command + self.terminator, 'ascii')
-        self.ser.write(input_bytes)
+        input_bytes = self.encode(command)
+        try:
+            self.ser.write(input_bytes)
+        except serial.SerialException:
+            self.consecutive_errors += 1
+            raise
 
     def query(self, string):
         """
-        Write a command and read the reply.
+        Write a command and read the reply,
+        through the command scheduler when it is started.
 
         Parameters
         ----------
@@ -80,11 +140,75 @@ class Light(object):
         answer : string
             answer read from the controller
         """
+        if self.scheduler is not None:
+            return self.scheduler.submit(string).result()
         with self.lock:
           self.write(string)
           answer = self.read()
           return answer 
+
+    def query_many(self, commands):
+        """
+        Write several commands in a row and read all the replies.
+        The serial port is held for the whole batch, so the replies
+        cannot be interleaved with other queries.
+        When the command scheduler is started, the commands are queued
+        together but higher priority commands may be sent in between.
+
+        Parameters
+        ----------
+        commands : list of strings
+            commands to be written to the controller
+
+        Returns
+        -------
+        answers : list of strings
+            answers read from the controller, in the order of the commands
+        """
+        if self.scheduler is not None:
+            futures = [self.scheduler.submit(command) for command in commands]
+            return [future.result() for future in futures]
+        with self.lock:
+            for command in commands:
+                self.write(command)
+            answers = [self.read() for command in commands]
+            return answers
       
+    def start_scheduler(self, telemetry_share = 0.5):
+        """
+        Send the commands through a priority command scheduler.
+
+        From then on, query, query_many and the set methods are served by priority
+        class (safety, control, telemetry, identity) within the byte budget of the link,
+        so that a burst of telemetry cannot delay set_off. The set commands still
+        queued when set_off is called are cancelled (they raise
+        concurrent.futures.CancelledError), so they cannot switch the LED back on.
+
+        Parameters
+        ----------
+        telemetry_share : float
+            share (0-1) of the link bandwidth available to telemetry and identity queries
+
+        Returns
+        -------
+        scheduler : CommandScheduler
+            scheduler of the light source, see CommandScheduler.metrics
+        """
+        if self.scheduler is None:
+            scheduler = CommandScheduler(self, telemetry_share)
+            scheduler.start()
+            self.scheduler = scheduler
+        return self.scheduler
+
+    def stop_scheduler(self):
+        """
+        Send the queued commands and go back to direct commands.
+        """
+        scheduler = self.scheduler
+        if scheduler is not None:
+            self.scheduler = None
+            scheduler.stop()
+
     def __del__(self):
         if self.ser:
             self.ser.close()
@@ -97,6 +221,9 @@ class MCLS_Light(Light):
     However, MCLS lightsources can be controlled with KL protocol version 2.0
     See class KL_Light for KL series lightsources 
     """
+    on = None
+    setpoint = None
+
     def __init__(self, port = None, verbose = True):
         """
         Light source object creator
@@ -165,12 +292,154 @@ class MCLS_Light(Light):
         ----------
         e : float
             emissivity in the 0.5-1 range
+
+        Raises
+        ------
+        ValueError
+            if the controller does not acknowledge the command
         """
         if 0<e<=1:
-            #self.intensity = e
             X = hex(int(e*255))
-            self.write('I' + X)
-    
+            answer = self.query('I' + X)
+            check_ack('I' + X, answer)
+            self.setpoint = int(e*255)/255
+
+    def set_precise_intensity(self, e):
+        """
+        Adjust LED intensity with the 11-bit resolution of the controller
+
+        Parameters
+        ----------
+        e : float
+            emissivity in the 0-1 range, 0 being a valid zero intensity
+
+        Raises
+        ------
+        ValueError
+            if the controller does not acknowledge the command
+        """
+        if 0<=e<=1:
+            X = hex(int(round(e*2047)))
+            answer = self.query('IP' + X)
+            check_ack('IP' + X, answer)
+            self.setpoint = int(round(e*2047))/2047
+
+    def query_value(self, command):
+        """
+        Query the controller and decode the reply.
+
+        Parameters
+        ----------
+        command : string
+            query to be written to the controller (e.g. 'BT?')
+
+        Returns
+        -------
+        value : float, bool, int, string or enum
+            decoded reply, see PySchott.Status.parse_reply
+
+        Raises
+        ------
+        ValueError
+            if the command is not a known query (it is then not written),
+            or the reply is empty (timeout) or cannot be decoded
+        """
+        if command not in queries:
+            raise ValueError('unknown query {!r}'.format(command))
+        return parse_reply(command, self.query(command))
+
+    @property
+    def status(self):
+        """
+        Get a snapshot of the whole state of the unit in a single batch of queries.
+
+        Returns
+        -------
+        status : MCLS_Status
+            typed status record, see MCLS_Status.to_array to store many of them
+
+        """
+        answers = self.query_many(MCLS_Status.commands)
+        return MCLS_Status.from_replies(answers)
+
+    def sweep(self, bits = 8, levels = None, result = None, batch = 8):
+        """
+        Step the LED through its output levels and read back the intensity and temperatures.
+
+        Several levels are written before their replies are read, so the sweep
+        is not slowed down by one serial round trip per query. The echo of each
+        set command is checked before its readbacks are decoded.
+        The result is filled in place and also kept as self.last_sweep:
+        an interrupted sweep is resumed with light.sweep(result = light.last_sweep).
+        The intensity set before the sweep is restored at the end.
+
+        Parameters
+        ----------
+        bits : int
+            8 to use the 'I' command, 11 to use the precise 'IP' command
+            (ignored when resuming, the bits of the previous sweep are used)
+        levels : array of ints, optional
+            levels to be set, all the non zero levels of the range if not given
+        result : numpy.ndarray, optional
+            result of a previous interrupted sweep, only its missing levels are measured
+        batch : int
+            number of levels written before reading their replies
+
+        Returns
+        -------
+        result : numpy.ndarray
+            array of dtype PySchott.Sweep.sweep_dtype, see PySchott.Sweep.calibration_table
+        """
+        if result is None:
+            if levels is None:
+                levels = np.arange(1, 2**bits)
+            result = new_sweep(levels, bits)
+        bits = result['bits'][0]
+        if bits == 8:
+            prefix = 'I'
+        elif bits == 11:
+            prefix = 'IP'
+        else:
+            raise ValueError('bits must be 8 or 11')
+        self.last_sweep = result
+        todo = pending(result)
+        n = len(sweep_commands)
+
+        initial = self.precise_intensity
+        with self.lock:
+            self.ser.reset_input_buffer()
+        complete = False
+        try:
+            for k in range(0, len(todo), batch):
+                rows = todo[k:k+batch]
+                commands = [prefix + hex(int(level)) for level in result['level'][rows]]
+                with self.lock:
+                    for command in commands:
+                        self.write(command)
+                        for query in sweep_commands:
+                            self.write(query)
+                    # one echo of the set command, then one reply per readback query
+                    answers = [self.read() for i in range((n + 1)*len(rows))]
+                for i, row in enumerate(rows):
+                    replies = answers[i*(n + 1):(i + 1)*(n + 1)]
+                    check_ack(commands[i], replies[0])
+                    values = [parse_reply(c, a) for c, a in zip(sweep_commands, replies[1:])]
+                    result[row] = (bits, result['level'][row], result['command'][row], *values)
+            complete = True
+        finally:
+            with self.lock:
+                if not complete:
+                    # replies of the interrupted batch may still be on the line: wait until it is quiet
+                    terminator = bytes(self.terminator, 'ascii')
+                    while self.ser.read_until(terminator):
+                        pass
+                self.ser.reset_input_buffer()
+                command = 'IP' + hex(int(round(initial*2047)))
+                self.write(command)
+                answer = self.read()
+            check_ack(command, answer)
+        return result
+
     @property 
     def knob_input_value(self): 
         """
@@ -182,8 +451,7 @@ class MCLS_Light(Light):
             front knob position as a percentage of full scale.
 
         """
-        answer = self.query('A0?')
-        kiv = float(answer[3:])/10
+        kiv = self.query_value('A0?')
         return kiv
     
     @property 
@@ -197,8 +465,7 @@ class MCLS_Light(Light):
             rear analog input in % of full scale
 
         """
-        answer = self.query('A1?')
-        riv = float(answer[3:])/10
+        riv = self.query_value('A1?')
         return riv
     
     @property 
@@ -212,8 +479,7 @@ class MCLS_Light(Light):
             temperature in °C
 
         """
-        answer = self.query('BT?')
-        T_C = float(answer[3:])
+        T_C = self.query_value('BT?')
         return T_C
     
     @property
@@ -227,11 +493,7 @@ class MCLS_Light(Light):
             state of the front switch
 
         """
-        answer = self.query('D0?')
-        if answer[-1]=='1': 
-            fss = True 
-        elif answer[-1]=='0': 
-            fss = False
+        fss = self.query_value('D0?')
         return fss
     
     @property
@@ -246,11 +508,7 @@ class MCLS_Light(Light):
             state of the digital input (False is low, True is high)
 
         """
-        answer = self.query('D1?')
-        if answer[-1]=='1': 
-            rdis = True 
-        elif answer[-1]=='0': 
-            rdis = False
+        rdis = self.query_value('D1?')
         return rdis
     
     @property
@@ -264,8 +522,7 @@ class MCLS_Light(Light):
             firmware version of the unit
 
         """
-        answer = self.query('F?')
-        version = float(answer[2:])
+        version = self.query_value('F?')
         return version
     
     @property
@@ -279,8 +536,7 @@ class MCLS_Light(Light):
             fan speed in RPM.
 
         """
-        answer = self.query('G?')
-        RPM = float(answer[2:])
+        RPM = self.query_value('G?')
         return RPM
     
     @property
@@ -294,11 +550,7 @@ class MCLS_Light(Light):
             True if enabled, False otherwise
 
         """
-        answer = self.query('HLF?')
-        if int(answer[-1])==0: 
-            control = False # 'front control is disabled'
-        if int(answer[-1])==1: 
-            control = True #'front control is enabled'
+        control = self.query_value('HLF?')
         return control 
     
     @property
@@ -312,11 +564,7 @@ class MCLS_Light(Light):
             True if enabled, False otherwise
 
         """
-        answer = self.query('HLM?')
-        if int(answer[-1])==0: 
-            control = False # 'front control is disabled'
-        if int(answer[-1])==1: 
-            control = True #'front control is enabled'
+        control = self.query_value('HLM?')
         return control 
     
     @property
@@ -324,22 +572,16 @@ class MCLS_Light(Light):
         """
         LED intensity 
         """
-        answer = self.query('I?')
-        hexa_value = answer[-2]   + answer[-1]   
-        intensity = int(hexa_value, 16)/255                 
-        return np.round(intensity, 2)     
+        intensity = self.query_value('I?')
+        return intensity
     
     @property
     def precise_intensity(self):
         """
         LED precise intensity 
         """
-        answer = self.query('IP?')
-        hexa_value = answer[-3] + answer[-2] + answer[-1]   
-        intensity = int(hexa_value, 16)
-        if intensity > 2047: 
-            intensity = 2047                 
-        return intensity/2047     
+        intensity = self.query_value('IP?')
+        return intensity
     
     @property 
     def control_lockout(self): 
@@ -352,15 +594,7 @@ class MCLS_Light(Light):
             Description of the control lockout setting.
 
         """
-        answer = self.query('K?')
-        if int(answer[-1])==0: 
-            control = 'all controls enabled'
-        if int(answer[-1])==1: 
-            control = 'front knob and switch disabled'
-        if int(answer[-1])==2: 
-            control = 'analog input disabled'
-        if int(answer[-1])==3: 
-            control = 'front knob, switch and analog input disabled'
+        control = self.query_value('K?').description
         return control
     
     @property
@@ -375,11 +609,7 @@ class MCLS_Light(Light):
             False: LED output is disabled
             
         """
-        answer = self.query('L?')
-        if answer[-1]=='1': 
-            output = True
-        elif answer[-1]=='0': 
-            output = False
+        output = self.query_value('L?')
         return output
         
     @property 
@@ -393,8 +623,7 @@ class MCLS_Light(Light):
             heatsink temperature in degrees Celsius in the range -5.0 to 99.9°C
 
         """
-        answer = self.query('LT?')
-        T_C = float(answer[3:])
+        T_C = self.query_value('LT?')
         return T_C
     
     
@@ -412,17 +641,7 @@ class MCLS_Light(Light):
             interface controlling the unit
 
         """
-        answer = self.query('M?')
-        if int(answer[-1])==0: 
-            control = 'Front panel'
-        if int(answer[-1])==1: 
-            control = 'Rear analog control'
-        if int(answer[-1])==2: 
-            control = 'RS232 port'
-        if int(answer[-1])==4: 
-            control = 'USB port'
-        if int(answer[-1])==7: 
-            control = None
+        control = self.query_value('M?').description
         return control
     
     @property 
@@ -436,11 +655,7 @@ class MCLS_Light(Light):
             product name
 
         """
-        answer = self.query('Q')
-        if len(answer)>2: 
-            name = answer[2:]
-        else: 
-            name = None
+        name = self.query_value('Q')
         return name
     
     @property 
@@ -454,8 +669,7 @@ class MCLS_Light(Light):
             DESCRIPTION.
 
         """
-        answer = self.query('VI?')
-        VI = float(answer[3:])
+        VI = self.query_value('VI?')
         return VI
     
     @property 
@@ -469,8 +683,7 @@ class MCLS_Light(Light):
             serial number.
 
         """
-        answer = self.query('Z')
-        serial = int(answer[3:])
+        serial = self.query_value('Z')
         return serial
     
     @property 
@@ -484,8 +697,7 @@ class MCLS_Light(Light):
             model number 
 
         """
-        answer = self.query('ZM')
-        model = answer[3:]
+        model = self.query_value('ZM')
         return model 
     
 class KL_Light(object):
@@ -0,0 +1,349 @@
+"""
+Remote access to a MCLS Schott light source over TCP
+
+The server speaks line delimited JSON-RPC 2.0: each request or batch (JSON array
+of requests) is a single line, and so is its response.
+"""
+import inspect
+import itertools
+import json
+import numbers
+import socket
+import socketserver
+import threading
+from concurrent.futures import Future
+from .PySchott import MCLS_Light
+from .Status import MCLS_Status, ControlSource, ControlLockout, queries
+
+# methods that change the state of the unit
+write_methods = ('set_on', 'set_off', 'set_intensity', 'set_precise_intensity')
+
+# read only properties of the unit
+read_properties = tuple(name for name, value in vars(MCLS_Light).items()
+                        if isinstance(value, property))
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+DEVICE_ERROR = -32000
+
+
+class RemoteError(Exception):
+    """
+    Error returned by the light server
+    """
+    def __init__(self, code, message):
+        super().__init__('{} ({})'.format(message, code))
+        self.code = code
+        self.message = message
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            response = self.server.light_server.handle_line(line)
+            if response is not None:
+                self.wfile.write(response + b'\n')
+                self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LightServer(object):
+    """
+    Expose a light source to other machines over TCP.
+
+    All clients share the serial connection of the light source. Identical
+    reads in flight at the same time (e.g. several clients polling the status)
+    are coalesced into a single serial query.
+    """
+    def __init__(self, light, host = '127.0.0.1', port = 5555):
+        """
+        Light server creator
+
+        Parameters
+        ----------
+        light : MCLS_Light
+            light source to be exposed
+        host : string
+            address to listen on ('0.0.0.0' for all the interfaces)
+        port : int
+            TCP port to listen on (0 to pick a free one, see address)
+        """
+        self.light = light
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.reads = 0
+        self.coalesced = 0
+        self._server = _Server((host, port), _Handler)
+        self._server.light_server = self
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        (host, port) the server is listening on
+        """
+        return self._server.server_address
+
+    def start(self):
+        """
+        Serve the requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        """
+        Serve the requests until stop is called from another thread.
+        """
+        self._server.serve_forever()
+
+    def stop(self):
+        """
+        Stop serving and close the listening socket. The light source is left open.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _read(self, key, function):
+        # single flight: the first caller reads, the concurrent ones wait for its result
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.reads += 1
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                future.set_result(function())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._inflight_lock:
+                    del self._inflight[key]
+        return future.result()
+
+    def _dispatch(self, method, params):
+        # function running the request on the light source, checked before the unit is used
+        if not isinstance(params, list):
+            raise RemoteError(INVALID_PARAMS, 'params must be a list')
+        if method in write_methods:
+            function = getattr(self.light, method)
+            try:
+                inspect.signature(function).bind(*params)
+            except TypeError as e:
+                raise RemoteError(INVALID_PARAMS, str(e)) from None
+            if not all(isinstance(p, numbers.Real) and not isinstance(p, bool) for p in params):
+                raise RemoteError(INVALID_PARAMS, '{} takes a number'.format(method))
+            return lambda: function(*params)
+        if method in read_properties:
+            if params:
+                raise RemoteError(INVALID_PARAMS, '{} takes no parameters'.format(method))
+            return lambda: self._read(method, lambda: getattr(self.light, method))
+        if method == 'query_value':
+            if len(params) != 1 or not isinstance(params[0], str):
+                raise RemoteError(INVALID_PARAMS, 'query_value takes a single command')
+            command = params[0]
+            # only the queries are allowed, any other command could change the state of the unit
+            if command not in queries:
+                raise RemoteError(INVALID_PARAMS, 'unknown query {!r}'.format(command))
+            return lambda: self._read(('query_value', command), lambda: self.light.query_value(command))
+        raise RemoteError(METHOD_NOT_FOUND, 'method not found')
+
+    def call(self, method, params):
+        """
+        Run a method of the light source.
+
+        Parameters
+        ----------
+        method : string
+            name of a set_* method, of a property of MCLS_Light, or 'query_value'
+        params : list
+            positional parameters of the method
+
+        Returns
+        -------
+        result : JSON serializable value
+
+        Raises
+        ------
+        RemoteError
+            if the method does not exist (METHOD_NOT_FOUND) or does not take
+            these parameters (INVALID_PARAMS); the errors raised by the light
+            source itself are not converted
+        """
+        result = self._dispatch(method, params)()
+        if isinstance(result, MCLS_Status):
+            result = result._asdict()
+        return result
+
+    def _handle_request(self, request):
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            return {'jsonrpc': '2.0', 'id': None,
+                    'error': {'code': INVALID_REQUEST, 'message': 'invalid request'}}
+        try:
+            result = self.call(request['method'], request.get('params', []))
+            response = {'result': result}
+        except RemoteError as e:
+            response = {'error': {'code': e.code, 'message': e.message}}
+        except Exception as e:
+            response = {'error': {'code': DEVICE_ERROR, 'message': str(e)}}
+        if 'id' not in request: # notification
+            return None
+        response['jsonrpc'] = '2.0'
+        response['id'] = request['id']
+        return response
+
+    def handle_line(self, line):
+        """
+        Answer a line of the protocol.
+
+        Parameters
+        ----------
+        line : bytes
+            JSON-RPC request or batch of requests
+
+        Returns
+        -------
+        response : bytes or None
+            JSON-RPC response, None if there is nothing to answer
+        """
+        try:
+            request = json.loads(line)
+        except ValueError:
+            response = {'jsonrpc': '2.0', 'id': None,
+                        'error': {'code': PARSE_ERROR, 'message': 'parse error'}}
+            return json.dumps(response).encode()
+        if isinstance(request, list):
+            response = [self._handle_request(r) for r in request]
+            response = [r for r in response if r is not None]
+            if not response:
+                return None
+        else:
+            response = self._handle_request(request)
+            if response is None:
+                return None
+        return json.dumps(response).encode()
+
+
+class RemoteLight(object):
+    """
+    Client of a LightServer, with the same methods and properties as MCLS_Light.
+    """
+    def __init__(self, host = '127.0.0.1', port = 5555, timeout = 5.):
+        """
+        Remote light creator
+
+        Parameters
+        ----------
+        host : string
+            address of the light server
+        port : int
+            TCP port of the light server
+        timeout : float
+            socket timeout in seconds
+        """
+        self.sock = socket.create_connection((host, port), timeout)
+        self.file = self.sock.makefile('rwb')
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _exchange(self, requests):
+        with self.lock:
+            self.file.write(json.dumps(requests).encode() + b'\n')
+            self.file.flush()
+            line = self.file.readline()
+        if not line:
+            raise ConnectionError('connection closed by the light server')
+        return json.loads(line)
+
+    def _request(self, method, params):
+        return {'jsonrpc': '2.0', 'id': next(self._ids), 'method': method, 'params': list(params)}
+
+    @staticmethod
+    def _result(method, response):
+        if 'error' in response:
+            raise RemoteError(response['error']['code'], response['error']['message'])
+        result = response['result']
+        if method == 'status':
+            result['control_lockout'] = ControlLockout(result['control_lockout'])
+            result['control_source'] = ControlSource(result['control_source'])
+            result = MCLS_Status(**result)
+        return result
+
+    def call(self, method, *params):
+        """
+        Run a method of the light source on the server.
+
+        Parameters
+        ----------
+        method : string
+            name of the method or property
+        *params
+            positional parameters of the method
+
+        Returns
+        -------
+        result
+            value returned by the method
+        """
+        response = self._exchange(self._request(method, params))
+        return self._result(method, response)
+
+    def batch(self, calls):
+        """
+        Run several methods in a single round trip.
+
+        Parameters
+        ----------
+        calls : list
+            method names, or (method name, list of parameters) tuples
+
+        Returns
+        -------
+        results : list
+            values returned by the methods, in the order of the calls
+        """
+        calls = [(c, []) if isinstance(c, str) else c for c in calls]
+        requests = [self._request(method, params) for method, params in calls]
+        responses = {r['id']: r for r in self._exchange(requests)}
+        return [self._result(method, responses[r['id']]) for (method, params), r in zip(calls, requests)]
+
+    def query_value(self, command):
+        return self.call('query_value', command)
+
+    def close(self):
+        """
+        Close the connection to the server.
+        """
+        self.file.close()
+        self.sock.close()
+
+
+def _remote_method(name):
+    def method(self, *params):
+        return self.call(name, *params)
+    method.__name__ = name
+    method.__doc__ = getattr(MCLS_Light, name).__doc__
+    return method
+
+
+def _remote_property(name):
+    return property(lambda self: self.call(name), doc=getattr(MCLS_Light, name).__doc__)
+
+
+for _name in write_methods:
+    setattr(RemoteLight, _name, _remote_method(_name))
+for _name in read_properties:
+    setattr(RemoteLight, _name, _remote_property(_name))
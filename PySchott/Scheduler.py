@@ -0,0 +1,332 @@
+"""
+Priority scheduling of the commands sent on the serial link of a light source
+"""
+from collections import deque
+from concurrent.futures import Future
+from enum import IntEnum
+import threading
+import time
+
+
+class Priority(IntEnum):
+    """
+    Priority classes of the commands, the lowest value being served first
+    """
+    SAFETY = 0
+    CONTROL = 1
+    TELEMETRY = 2
+    IDENTITY = 3
+
+
+# queries about the identity of the unit, that never change
+identity_commands = ('Q', 'Z', 'ZM', 'F?')
+
+
+def command_priority(command):
+    """
+    Priority class of a command.
+
+    Parameters
+    ----------
+    command : string
+        command to be written to the controller
+
+    Returns
+    -------
+    priority : Priority
+        SAFETY for the LED switch off, IDENTITY for the identity queries,
+        TELEMETRY for the other queries and CONTROL for the other commands
+    """
+    if command == 'L0':
+        return Priority.SAFETY
+    if command in identity_commands:
+        return Priority.IDENTITY
+    if command.endswith('?'):
+        return Priority.TELEMETRY
+    return Priority.CONTROL
+
+
+class _Item(object):
+    __slots__ = ('command', 'priority', 'future', 'submitted', 'cost')
+
+    def __init__(self, command, priority, cost):
+        self.command = command
+        self.priority = priority
+        self.future = Future()
+        self.submitted = time.monotonic()
+        self.cost = cost
+
+
+class CommandScheduler(object):
+    """
+    Serve the commands of a light source by priority class within the byte budget of its link.
+
+    A single dispatcher thread writes the commands one at a time and reads the
+    reply of each one, always taking the oldest command of the highest non empty
+    priority class. Telemetry and identity commands are also limited to a share
+    of the link bandwidth (token bucket of bytes), so a burst of reads cannot fill
+    the link. Identical telemetry and identity queries waiting in the queue are
+    sent only once and share their reply.
+
+    A safety command jumps ahead of the control commands queued before it, so
+    these are cancelled when it is submitted (their futures raise CancelledError):
+    a set_on or set_intensity issued before set_off is never applied after it.
+
+    A command is never interrupted once written, so a safety command waits at most
+    for the command in flight and for the safety commands queued before it (see
+    latency_bound), plus the time other users hold the serial lock (sweeps and
+    command sequences hold it for their whole batches).
+    """
+    command_bytes = 9 # longest command frame, '&IP0x7ff\r'
+    telemetry_reply_bytes = 12 # longest telemetry reply frame, e.g. '&vi23.45\r'
+    # identity reply frames, from the example replies of the remote operations guide
+    identity_reply_bytes = {'Q': 41, 'Z': 9, 'ZM': 10, 'F?': 6}
+
+    def __init__(self, light, telemetry_share = 0.5, burst = 64):
+        """
+        Command scheduler creator
+
+        Parameters
+        ----------
+        light : Light
+            light source whose commands are scheduled
+        telemetry_share : float
+            share (0-1) of the link bandwidth available to telemetry and identity commands
+        burst : int
+            number of bytes telemetry and identity commands may send in a burst
+
+        Raises
+        ------
+        ValueError
+            if telemetry_share is not in the ]0, 1] range
+        """
+        if not 0 < telemetry_share <= 1:
+            raise ValueError('telemetry_share must be in the ]0, 1] range')
+        self.light = light
+        bits_per_byte = 1 + light.bytesize + light.stopbits
+        self.bytes_per_second = light.baudrate/bits_per_byte
+        self.telemetry_rate = telemetry_share*self.bytes_per_second
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._queues = {p: deque() for p in Priority}
+        self._pending = {} # queued queries, for deduplication
+        self._cv = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.error = None # exception that stopped the dispatcher thread
+        self.deduplicated = 0
+        self.cancelled = 0
+        self._max_depth = {p: 0 for p in Priority}
+        self._waits = {p: [0, 0., 0.] for p in Priority} # count, sum, max
+
+    @property
+    def command_time(self):
+        """
+        Longest time a single command can hold the link in seconds:
+        transmission of the command and of its reply, plus the reply timeout
+        """
+        reply_bytes = max(self.telemetry_reply_bytes, *self.identity_reply_bytes.values())
+        return (self.command_bytes + reply_bytes)/self.bytes_per_second + self.light.timeout
+
+    def reply_bytes(self, command):
+        """
+        Length of the reply frame to a command, used for the byte budget.
+
+        Parameters
+        ----------
+        command : string
+            command to be written to the controller
+
+        Returns
+        -------
+        n : int
+            number of bytes: the identity reply, the longest telemetry reply for
+            the other queries, and the lowercase echo for the control commands
+        """
+        if command in self.identity_reply_bytes:
+            return self.identity_reply_bytes[command]
+        if command.endswith('?'):
+            return self.telemetry_reply_bytes
+        return len(self.light.encode(command))
+
+    def latency_bound(self, priority = Priority.SAFETY):
+        """
+        Worst case time before a command submitted now starts being written.
+
+        Parameters
+        ----------
+        priority : Priority
+            priority class of the command
+
+        Returns
+        -------
+        latency : float
+            bound in seconds, valid for the SAFETY and CONTROL classes (the lower
+            classes also wait for the byte budget) and excluding the time other
+            users hold the serial lock
+        """
+        with self._cv:
+            ahead = sum(len(self._queues[p]) for p in Priority if p <= priority)
+        return (1 + ahead)*self.command_time
+
+    def submit(self, command, priority = None):
+        """
+        Queue a command.
+
+        Parameters
+        ----------
+        command : string
+            command to be written to the controller
+        priority : Priority, optional
+            priority class, see command_priority if not given
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            future of the reply of the controller
+        """
+        if priority is None:
+            priority = command_priority(command)
+        with self._cv:
+            if not self._running:
+                raise RuntimeError('the command scheduler is not running') from self.error
+            if priority >= Priority.TELEMETRY:
+                item = self._pending.get(command)
+                if item is not None:
+                    self.deduplicated += 1
+                    return item.future
+            elif priority == Priority.SAFETY:
+                self._cancel(Priority.CONTROL)
+            item = _Item(command, priority, len(self.light.encode(command)) + self.reply_bytes(command))
+            if priority >= Priority.TELEMETRY:
+                self._pending[command] = item
+            queue = self._queues[priority]
+            queue.append(item)
+            self._max_depth[priority] = max(self._max_depth[priority], len(queue))
+            self._cv.notify()
+        return item.future
+
+    def _cancel(self, priority):
+        # called with the condition held: cancel the queued commands of a class
+        queue = self._queues[priority]
+        while queue:
+            item = queue.popleft()
+            if self._pending.get(item.command) is item:
+                del self._pending[item.command]
+            item.future.cancel()
+            self.cancelled += 1
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled)*self.telemetry_rate)
+        self._refilled = now
+
+    def _next(self):
+        # called with the condition held: next item to send, or the time to wait for it
+        now = time.monotonic()
+        self._refill(now)
+        for priority in Priority:
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            item = queue[0]
+            if priority >= Priority.TELEMETRY and self._running and self._tokens < item.cost:
+                return None, (item.cost - self._tokens)/self.telemetry_rate
+            queue.popleft()
+            if self._pending.get(item.command) is item:
+                del self._pending[item.command]
+            # every command uses the link, but only the low classes are held back by the budget
+            self._tokens = max(self._tokens - item.cost, -self.burst)
+            return item, None
+        return None, None
+
+    def _run(self):
+        try:
+            self._dispatch()
+        except BaseException as e:
+            # the queued commands would never be sent: fail their futures
+            with self._cv:
+                self.error = e
+                self._running = False
+                for queue in self._queues.values():
+                    while queue:
+                        future = queue.popleft().future
+                        if future.set_running_or_notify_cancel():
+                            future.set_exception(RuntimeError('the command scheduler stopped: {!r}'.format(e)))
+                self._pending.clear()
+            raise
+
+    def _dispatch(self):
+        light = self.light
+        while True:
+            with self._cv:
+                while True:
+                    item, wait = self._next()
+                    if item is not None:
+                        break
+                    if wait is None and not self._running:
+                        return
+                    self._cv.wait(wait)
+                if not item.future.set_running_or_notify_cancel():
+                    continue
+                stats = self._waits[item.priority]
+                waited = time.monotonic() - item.submitted
+                stats[0] += 1
+                stats[1] += waited
+                stats[2] = max(stats[2], waited)
+            try:
+                with light.lock:
+                    light.write(item.command)
+                    answer = light.read()
+                item.future.set_result(answer)
+            except Exception as e:
+                item.future.set_exception(e)
+
+    def start(self):
+        """
+        Start the dispatcher thread.
+        """
+        with self._cv:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Send the queued commands, then stop the dispatcher thread.
+        """
+        with self._cv:
+            self._running = False
+            self._cv.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def metrics(self):
+        """
+        Queue and wait time metrics of each priority class.
+
+        Returns
+        -------
+        metrics : dict
+            for each priority class name: current and max queue depth,
+            number of commands sent, mean and max wait before being sent in seconds;
+            the number of deduplicated queries and of control commands cancelled
+            by a safety command
+        """
+        with self._cv:
+            metrics = {}
+            for p in Priority:
+                n, s, w_max = self._waits[p]
+                metrics[p.name] = {'depth': len(self._queues[p]),
+                                   'max_depth': self._max_depth[p],
+                                   'sent': n,
+                                   'wait_mean': s/n if n else 0.,
+                                   'wait_max': w_max,
+                                   }
+            metrics['deduplicated'] = self.deduplicated
+            metrics['cancelled'] = self.cancelled
+        return metrics
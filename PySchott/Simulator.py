@@ -0,0 +1,167 @@
+"""
+Stand-in for a MCLS light source, to use the driver without the hardware
+"""
+from collections import deque
+import threading
+import time
+import serial
+from .PySchott import MCLS_Light
+
+
+class SimulatedSerial(object):
+    """
+    Serial port connected to a simulated MC-LS unit.
+
+    The unit answers every command as described in the remote operations guide:
+    queries with '&' followed by the lowercase command and the value, control
+    commands with their lowercase echo, errors with '&n'. All the replies end
+    with a carriage return.
+    """
+    def __init__(self, port = 'sim', timeout = 0.1, latency = 0., serial_number = 1):
+        """
+        Simulated serial port creator
+
+        Parameters
+        ----------
+        port : string
+            name of the port
+        timeout : float
+            read timeout in seconds
+        latency : float
+            time the unit takes to answer a command in seconds, the commands
+            being answered one after the other
+        serial_number : int
+            serial number of the unit
+        """
+        self.port = port
+        self.timeout = timeout
+        self.latency = latency
+        self.serial_number = serial_number
+        self.is_open = True
+        self.log = [] # commands received, in order
+        self.on = False
+        self.level = 0 # 11-bit intensity
+        self.knob = 514
+        self.analog = 230
+        self.board_temperature = 30.
+        self.source = 7
+        self.lockout = 0
+        self._buffer = b''
+        self._replies = deque() # (time the reply is available, bytes)
+        self._busy = 0. # time the unit is done with the commands received
+        self._cv = threading.Condition()
+
+    @property
+    def heatsink_temperature(self):
+        return 25. + (30.*self.level/2047 if self.on else 0.)
+
+    def _answer(self, command):
+        c = command.upper()
+        values = {'A0?': '{:04d}'.format(self.knob),
+                  'A1?': '{:04d}'.format(self.analog),
+                  'BT?': '{:.1f}'.format(self.board_temperature),
+                  'D0?': '0',
+                  'D1?': '1',
+                  'F?': '1.0',
+                  'G?': '2518' if self.on else '0',
+                  'HLF?': '1' if self.lockout in (0, 2) else '0',
+                  'HLM?': '1' if self.lockout in (0, 1) else '0',
+                  'I?': '{:02x}'.format(self.level*255//2047),
+                  'IP?': '{:03x}'.format(self.level),
+                  'K?': str(self.lockout),
+                  'L?': '1' if self.on else '0',
+                  'LT?': '{:.1f}'.format(self.heatsink_temperature),
+                  'M?': str(self.source),
+                  'Q': 'SCHOTT Microscopy Light Source (MC-LS)',
+                  'VI?': '23.45',
+                  'Z': '{:06d}'.format(self.serial_number),
+                  'ZM': 'A20990',
+                  }
+        if c in values:
+            return '&' + c.rstrip('?').lower() + values[c]
+        try:
+            if c in ('L0', 'L1'):
+                self.on = c == 'L1'
+            elif c.startswith('IP'):
+                self.level = min(int(c[2:], 16), 2047)
+            elif c.startswith('I'):
+                self.level = min(int(c[1:], 16), 255)*2047//255
+            else:
+                return '&n'
+        except ValueError:
+            return '&n'
+        self.source = 4
+        return '&' + command.lower()
+
+    def write(self, data):
+        if not self.is_open:
+            raise serial.SerialException('port closed')
+        self._buffer += data
+        while b'\r' in self._buffer:
+            frame, self._buffer = self._buffer.split(b'\r', 1)
+            if b'&' not in frame:
+                continue
+            command = frame[frame.index(b'&') + 1:].decode('ascii')
+            self.log.append(command)
+            reply = (self._answer(command) + '\r').encode('ascii')
+            with self._cv:
+                self._busy = max(self._busy, time.monotonic()) + self.latency
+                self._replies.append((self._busy, reply))
+                self._cv.notify_all()
+        return len(data)
+
+    def read_until(self, expected = b'\n', size = None):
+        deadline = time.monotonic() + self.timeout
+        with self._cv:
+            while True:
+                if not self.is_open:
+                    raise serial.SerialException('port closed')
+                now = time.monotonic()
+                if self._replies and self._replies[0][0] <= now:
+                    return self._replies.popleft()[1]
+                if now >= deadline:
+                    return b''
+                wait = deadline - now
+                if self._replies:
+                    wait = min(wait, self._replies[0][0] - now)
+                self._cv.wait(wait)
+
+    def reset_input_buffer(self):
+        # only the replies already received are discarded, the others are still to come
+        now = time.monotonic()
+        with self._cv:
+            while self._replies and self._replies[0][0] <= now:
+                self._replies.popleft()
+
+    def close(self):
+        self.is_open = False
+        with self._cv:
+            self._cv.notify_all()
+
+
+class SimulatedLight(MCLS_Light):
+    """
+    MCLS_Light driving a SimulatedSerial unit instead of a serial port.
+    The same unit (self.device) is found again when the port is reopened.
+    """
+    def __init__(self, port = 'sim', latency = 0., serial_number = 1):
+        """
+        Simulated light source creator
+
+        Parameters
+        ----------
+        port : string
+            name of the simulated port
+        latency : float
+            time the unit takes to answer a command in seconds
+        serial_number : int
+            serial number of the unit
+        """
+        self.device = SimulatedSerial(port, self.timeout, latency, serial_number)
+        super().__init__(port)
+
+    def open_serial(self, port):
+        self.device.port = port
+        self.device.is_open = True
+        self.device.reset_input_buffer()
+        return self.device
@@ -0,0 +1,268 @@
+"""
+Typed status record and reply parsing for the MCLS Schott light sources
+"""
+from enum import IntEnum
+from typing import NamedTuple
+import re
+import time
+import numpy as np
+
+
+class ControlSource(IntEnum):
+    """
+    Interface controlling the unit, as coded in the reply to 'M?'
+    """
+    FRONT_PANEL = 0
+    REAR_ANALOG = 1
+    RS232 = 2
+    USB = 4
+    NONE = 7
+
+    @property
+    def description(self):
+        """
+        Human readable name of the interface (None if no interface has control)
+        """
+        return _control_source_descriptions[self]
+
+
+class ControlLockout(IntEnum):
+    """
+    Control lockout setting, as coded in the reply to 'K?'
+    """
+    NONE = 0
+    FRONT = 1
+    ANALOG = 2
+    FRONT_AND_ANALOG = 3
+
+    @property
+    def description(self):
+        """
+        Human readable description of the lockout setting
+        """
+        return _control_lockout_descriptions[self]
+
+
+_control_source_descriptions = {ControlSource.FRONT_PANEL: 'Front panel',
+                                ControlSource.REAR_ANALOG: 'Rear analog control',
+                                ControlSource.RS232: 'RS232 port',
+                                ControlSource.USB: 'USB port',
+                                ControlSource.NONE: None,
+                                }
+
+_control_lockout_descriptions = {ControlLockout.NONE: 'all controls enabled',
+                                 ControlLockout.FRONT: 'front knob and switch disabled',
+                                 ControlLockout.ANALOG: 'analog input disabled',
+                                 ControlLockout.FRONT_AND_ANALOG: 'front knob, switch and analog input disabled',
+                                 }
+
+
+def _parse_flag(answer):
+    if answer[-1] == '1':
+        return True
+    if answer[-1] == '0':
+        return False
+    raise ValueError(answer)
+
+
+def _parse_intensity(answer):
+    return np.round(int(answer[-2:], 16)/255, 2)
+
+
+def _parse_precise_intensity(answer):
+    return min(int(answer[-3:], 16), 2047)/2047
+
+
+def _parse_product_name(answer):
+    if len(answer) > 2:
+        return answer[2:]
+    return None
+
+
+_parsers = {'A0?': lambda answer: float(answer[3:])/10,
+            'A1?': lambda answer: float(answer[3:])/10,
+            'BT?': lambda answer: float(answer[3:]),
+            'D0?': _parse_flag,
+            'D1?': _parse_flag,
+            'F?': lambda answer: float(answer[2:]),
+            'G?': lambda answer: float(answer[2:]),
+            'HLF?': _parse_flag,
+            'HLM?': _parse_flag,
+            'I?': _parse_intensity,
+            'IP?': _parse_precise_intensity,
+            'K?': lambda answer: ControlLockout(int(answer[-1])),
+            'L?': _parse_flag,
+            'LT?': lambda answer: float(answer[3:]),
+            'M?': lambda answer: ControlSource(int(answer[-1])),
+            'Q': _parse_product_name,
+            'VI?': lambda answer: float(answer[3:]),
+            'Z': lambda answer: int(answer[3:]),
+            'ZM': lambda answer: answer[3:],
+            }
+
+# queries that parse_reply decodes, none of them changes the state of the unit
+queries = tuple(_parsers)
+
+
+def parse_reply(command, answer):
+    """
+    Convert the controller reply to a query into a typed value.
+
+    Parameters
+    ----------
+    command : string
+        query sent to the controller (e.g. 'BT?')
+    answer : string
+        reply read from the controller
+
+    Returns
+    -------
+    value : float, bool, int, string, ControlSource or ControlLockout
+        decoded value
+
+    Raises
+    ------
+    ValueError
+        if the query is unknown, or the reply is empty (timeout) or cannot be decoded
+    """
+    if command not in _parsers:
+        raise ValueError('unknown query {!r}'.format(command))
+    try:
+        return _parsers[command](answer)
+    except (IndexError, ValueError):
+        raise ValueError('unexpected reply {!r} to {!r}'.format(answer, command)) from None
+
+
+def check_ack(command, answer):
+    """
+    Check the reply to a control command (e.g. 'IP0x400'), which is its echo
+    in lowercase: '&' followed by the command mnemonic and its parameter.
+
+    Parameters
+    ----------
+    command : string
+        control command sent to the controller
+    answer : string
+        reply read from the controller
+
+    Raises
+    ------
+    ValueError
+        if the reply is empty (timeout), a negative acknowledgement,
+        or the acknowledgement of another command
+    """
+    mnemonic = re.match('[A-Za-z]*', command).group().lower()
+    ack = answer.lower()
+    if not ack.startswith('&' + mnemonic) or ack[len(mnemonic)+1:len(mnemonic)+2].isalpha():
+        raise ValueError('unexpected reply {!r} to {!r}'.format(answer, command))
+
+
+class MCLS_Status(NamedTuple):
+    """
+    Snapshot of the state of a MCLS light source.
+
+    Use MCLS_Status.to_array to store many snapshots in a NumPy structured
+    array of dtype MCLS_Status.dtype, and MCLS_Status.from_array to get them back.
+    """
+    time: float
+    LED_output_enable: bool
+    intensity: float
+    precise_intensity: float
+    knob_input_value: float
+    rear_input_value: float
+    front_switch_state: bool
+    remote_digital_input_state: bool
+    board_temperature: float
+    LED_heatsink_temperature: float
+    fan_speed: float
+    input_voltage: float
+    control_lockout: ControlLockout
+    control_source: ControlSource
+
+    # controller query for each field after time, in field order
+    commands = ('L?', 'I?', 'IP?', 'A0?', 'A1?', 'D0?', 'D1?',
+                'BT?', 'LT?', 'G?', 'VI?', 'K?', 'M?')
+
+    dtype = np.dtype([('time', 'f8'),
+                      ('LED_output_enable', '?'),
+                      ('intensity', 'f8'),
+                      ('precise_intensity', 'f8'),
+                      ('knob_input_value', 'f8'),
+                      ('rear_input_value', 'f8'),
+                      ('front_switch_state', '?'),
+                      ('remote_digital_input_state', '?'),
+                      ('board_temperature', 'f8'),
+                      ('LED_heatsink_temperature', 'f8'),
+                      ('fan_speed', 'f8'),
+                      ('input_voltage', 'f8'),
+                      ('control_lockout', 'u1'),
+                      ('control_source', 'u1'),
+                      ])
+
+    @classmethod
+    def from_replies(cls, answers, t = None):
+        """
+        Build a status record from the replies to MCLS_Status.commands.
+
+        Parameters
+        ----------
+        answers : list of strings
+            replies read from the controller, in the order of MCLS_Status.commands
+        t : float, optional
+            timestamp of the snapshot (time.time() if not given)
+
+        Returns
+        -------
+        status : MCLS_Status
+        """
+        if t is None:
+            t = time.time()
+        values = [parse_reply(c, a) for c, a in zip(cls.commands, answers)]
+        return cls(t, *values)
+
+    def to_record(self):
+        """
+        Convert the snapshot into a 0-d NumPy structured array.
+
+        Returns
+        -------
+        record : numpy.ndarray
+            array of dtype MCLS_Status.dtype
+        """
+        return np.array(tuple(self), dtype=self.dtype)
+
+    @classmethod
+    def to_array(cls, statuses):
+        """
+        Pack a sequence of snapshots into a NumPy structured array.
+
+        Parameters
+        ----------
+        statuses : iterable of MCLS_Status
+
+        Returns
+        -------
+        records : numpy.ndarray
+            1-d array of dtype MCLS_Status.dtype
+        """
+        return np.array([tuple(s) for s in statuses], dtype=cls.dtype)
+
+    @classmethod
+    def from_array(cls, records):
+        """
+        Unpack a NumPy structured array into a list of snapshots.
+
+        Parameters
+        ----------
+        records : numpy.ndarray
+            array of dtype MCLS_Status.dtype
+
+        Returns
+        -------
+        statuses : list of MCLS_Status
+        """
+        statuses = []
+        for r in np.atleast_1d(records).tolist():
+            statuses.append(cls(float(r[0]), *r[1:-2],
+                                ControlLockout(r[-2]), ControlSource(r[-1])))
+        return statuses
@@ -0,0 +1,75 @@
+"""
+Intensity characterization sweeps of the MCLS Schott light sources
+"""
+import numpy as np
+
+# queries read back after each level of a sweep, in field order
+sweep_commands = ('I?', 'IP?', 'LT?', 'BT?')
+
+sweep_dtype = np.dtype([('bits', 'u1'),
+                        ('level', 'i4'),
+                        ('command', 'f8'),
+                        ('intensity', 'f8'),
+                        ('precise_intensity', 'f8'),
+                        ('LED_heatsink_temperature', 'f8'),
+                        ('board_temperature', 'f8'),
+                        ])
+
+
+def new_sweep(levels, bits):
+    """
+    Preallocate the result array of a sweep.
+
+    Parameters
+    ----------
+    levels : array of ints
+        output levels to be set
+    bits : int
+        resolution of the levels (8 or 11)
+
+    Returns
+    -------
+    result : numpy.ndarray
+        array of dtype sweep_dtype, with the readbacks set to NaN
+    """
+    result = np.zeros(len(levels), dtype=sweep_dtype)
+    for name in sweep_dtype.names[3:]:
+        result[name] = np.nan
+    result['bits'] = bits
+    result['level'] = levels
+    result['command'] = result['level']/(2**bits - 1)
+    return result
+
+
+def pending(result):
+    """
+    Indices of the levels of a sweep that have not been read back yet.
+    """
+    return np.flatnonzero(np.isnan(result['precise_intensity']))
+
+
+def calibration_table(result, field = 'precise_intensity'):
+    """
+    Build an intensity mapping table from a sweep result.
+
+    The table is sorted by measured value with duplicates removed, so the command
+    giving a wanted output is np.interp(wanted, table['measured'], table['command']).
+
+    Parameters
+    ----------
+    result : numpy.ndarray
+        array of dtype sweep_dtype returned by MCLS_Light.sweep
+    field : string
+        readback used as measured value
+
+    Returns
+    -------
+    table : numpy.ndarray
+        structured array with 'measured' and 'command' fields
+    """
+    done = result[~np.isnan(result[field])]
+    measured, index = np.unique(done[field], return_index=True)
+    table = np.empty(len(measured), dtype=[('measured', 'f8'), ('command', 'f8')])
+    table['measured'] = measured
+    table['command'] = done['command'][index]
+    return table
@@ -0,0 +1,323 @@
+"""
+Thermal model and predictive derating of the MCLS Schott light sources
+"""
+import time
+import numpy as np
+
+# temperatures modelled by ThermalModel, in column order
+temperature_fields = ('LED_heatsink_temperature', 'board_temperature')
+
+
+class ThermalModel(object):
+    """
+    Rolling first order model of the unit temperatures.
+
+    Each temperature T follows dT/dt = k0 + k1*intensity + k2*fan_speed + k3*T,
+    the coefficients being fitted by least squares over the recent history.
+    """
+    def __init__(self, size = 600):
+        """
+        Thermal model creator
+
+        Parameters
+        ----------
+        size : int
+            number of samples kept in the history
+        """
+        # columns: time, intensity, fan speed, then the temperatures
+        self.history = np.full((size, 3 + len(temperature_fields)), np.nan)
+        self.count = 0
+        self.coefficients = None
+
+    def add(self, status):
+        """
+        Add a sample to the history.
+
+        Parameters
+        ----------
+        status : MCLS_Status
+            status snapshot of the unit
+        """
+        intensity = status.precise_intensity if status.LED_output_enable else 0.
+        row = [status.time, intensity, status.fan_speed]
+        row += [getattr(status, name) for name in temperature_fields]
+        self.history[self.count % len(self.history)] = row
+        self.count += 1
+        self.coefficients = None # refitted on the next forecast
+
+    @property
+    def samples(self):
+        """
+        History samples in chronological order
+        """
+        n = len(self.history)
+        if self.count <= n:
+            return self.history[:self.count]
+        return np.roll(self.history, -(self.count % n), axis=0)
+
+    def fit(self):
+        """
+        Fit the model coefficients on the history.
+
+        Returns
+        -------
+        coefficients : numpy.ndarray
+            array of shape (4, number of temperatures), one column per temperature
+
+        Raises
+        ------
+        ValueError
+            if the history is too short to fit the model
+        """
+        samples = self.samples
+        if len(samples) < 8:
+            raise ValueError('at least 8 samples are needed to fit the thermal model')
+        dt = np.diff(samples[:, 0])
+        T = samples[:, 3:]
+        rates = np.diff(T, axis=0)/dt[:, None]
+        X = np.column_stack([np.ones(len(dt)), samples[:-1, 1], samples[:-1, 2]])
+        coefficients = np.empty((4, T.shape[1]))
+        # the temperature regressor differs for each column: solve one small system per temperature
+        for j in range(T.shape[1]):
+            A = np.column_stack([X, T[:-1, j]])
+            coefficients[:, j] = np.linalg.lstsq(A, rates[:, j], rcond=None)[0]
+        self.coefficients = coefficients
+        return coefficients
+
+    def forecast(self, durations, intensities, T0 = None, fan_speed = None, step = 1.):
+        """
+        Predict the temperatures along an intensity schedule.
+
+        Parameters
+        ----------
+        durations : array of floats
+            duration of each step of the schedule in seconds
+        intensities : array of floats
+            intensity (0-1) of each step of the schedule
+        T0 : array of floats, optional
+            starting temperatures, the last recorded ones if not given
+        fan_speed : float, optional
+            fan speed during the schedule, the mean of the last recorded ones if not given
+        step : float
+            time resolution of the forecast in seconds
+
+        Returns
+        -------
+        t : numpy.ndarray
+            forecast times from the start of the schedule in seconds
+        T : numpy.ndarray
+            forecast temperatures, one column per temperature
+        """
+        if self.coefficients is None:
+            self.fit()
+        samples = self.samples
+        if T0 is None:
+            T0 = samples[-1, 3:]
+        if fan_speed is None:
+            fan_speed = np.mean(samples[-10:, 2])
+        k0, k1, k2, k3 = self.coefficients
+        T = np.asarray(T0, dtype=float)
+        times = [np.zeros(1)]
+        temperatures = [T[None, :]]
+        start = 0.
+        for duration, intensity in zip(durations, intensities):
+            n = max(int(np.ceil(duration/step)), 1)
+            t = np.linspace(0, duration, n + 1)[1:, None]
+            a = k0 + k1*intensity + k2*fan_speed
+            # exact solution of dT/dt = a + k3*T for a constant intensity,
+            # each branch computed on its own columns only
+            decay = np.abs(k3) > 1e-12
+            segment = np.empty((n, len(T)))
+            T_inf = -a[decay]/k3[decay]
+            segment[:, decay] = T_inf + (T[decay] - T_inf)*np.exp(k3[decay]*t)
+            segment[:, ~decay] = T[~decay] + a[~decay]*t
+            times.append(start + t[:, 0])
+            temperatures.append(segment)
+            T = segment[-1]
+            start += duration
+        return np.concatenate(times), np.concatenate(temperatures)
+
+
+class ThermalScheduler(object):
+    """
+    Check intensity schedules against temperature limits before running them.
+
+    A schedule is a list of (duration in seconds, intensity) steps. The thermal
+    model is fed with status snapshots (see record) and used to forecast when a
+    schedule would cross a limit, so it can be derated or reordered beforehand.
+    """
+    def __init__(self, light, limits = None, size = 600, margin = 1.):
+        """
+        Thermal scheduler creator
+
+        Parameters
+        ----------
+        light : MCLS_Light
+            light source to be scheduled
+        limits : dict, optional
+            highest allowed temperature in °C for 'LED_heatsink_temperature'
+            and 'board_temperature' (60 and 50 °C if not given)
+        size : int
+            number of samples kept in the history of the model
+        margin : float
+            safety margin in °C kept below the limits when derating
+        """
+        self.light = light
+        if limits is None:
+            limits = {'LED_heatsink_temperature': 60., 'board_temperature': 50.}
+        self.limits = limits
+        self.margin = margin
+        self.model = ThermalModel(size)
+
+    def _limits(self, margin = 0.):
+        return np.array([self.limits.get(name, np.inf) for name in temperature_fields]) - margin
+
+    def record(self):
+        """
+        Read the status of the unit and add it to the model history.
+
+        Returns
+        -------
+        status : MCLS_Status
+        """
+        status = self.light.status
+        self.model.add(status)
+        return status
+
+    def forecast(self, schedule, margin = 0.):
+        """
+        Forecast a schedule and find when it crosses the limits.
+
+        Parameters
+        ----------
+        schedule : list of (float, float)
+            (duration in seconds, intensity) steps
+        margin : float
+            margin in °C below the limits
+
+        Returns
+        -------
+        crossing : float or None
+            time in seconds from the start of the schedule when a limit is
+            first crossed, None if the schedule stays below the limits
+        peak : numpy.ndarray
+            highest forecast temperatures
+        """
+        durations, intensities = np.asarray(schedule, dtype=float).T
+        t, T = self.model.forecast(durations, intensities)
+        over = np.any(T > self._limits(margin), axis=1)
+        crossing = float(t[np.argmax(over)]) if over.any() else None
+        return crossing, T.max(axis=0)
+
+    def derate(self, schedule):
+        """
+        Scale down the intensities of a schedule so that it stays below the limits.
+
+        The intensities above the derating level are clipped to it, the level
+        being the highest one keeping the forecast below the limits minus the margin.
+
+        Parameters
+        ----------
+        schedule : list of (float, float)
+            (duration in seconds, intensity) steps
+
+        Returns
+        -------
+        schedule : list of (float, float)
+            derated schedule (unchanged if it already stays below the limits)
+
+        Raises
+        ------
+        ValueError
+            if the forecast crosses the limits even with all the intensities at 0
+        """
+        durations, intensities = np.asarray(schedule, dtype=float).T
+
+        def derated(level):
+            return list(zip(durations.tolist(), np.minimum(intensities, level).tolist()))
+
+        if self.forecast(schedule, self.margin)[0] is None:
+            return [tuple(s) for s in schedule]
+        crossing = self.forecast(derated(0.), self.margin)[0]
+        if crossing is not None:
+            raise ValueError('the limits are crossed after {:.1f} s even at zero intensity'.format(crossing))
+        low, high = 0., intensities.max()
+        for i in range(20):
+            level = (low + high)/2
+            if self.forecast(derated(level), self.margin)[0] is None:
+                low = level
+            else:
+                high = level
+        return derated(low)
+
+    def reorder(self, schedule):
+        """
+        Reorder the steps of a schedule to lower its peak temperatures.
+
+        The steps are picked one by one, each time the one giving the lowest
+        forecast peak, relative to the limits, from the current state.
+
+        Parameters
+        ----------
+        schedule : list of (float, float)
+            (duration in seconds, intensity) steps
+
+        Returns
+        -------
+        schedule : list of (float, float)
+            reordered schedule
+        """
+        remaining = [tuple(s) for s in schedule]
+        ordered = []
+        limits = self._limits()
+        while remaining:
+            scores = [np.max(self.forecast(ordered + [s])[1] - limits) for s in remaining]
+            ordered.append(remaining.pop(int(np.argmin(scores))))
+        return ordered
+
+    def plan(self, schedule, reorder = False):
+        """
+        Make a schedule safe: reorder it if allowed, then derate it if still needed.
+
+        Parameters
+        ----------
+        schedule : list of (float, float)
+            (duration in seconds, intensity) steps
+        reorder : bool
+            allow the steps to be reordered
+
+        Returns
+        -------
+        schedule : list of (float, float)
+            schedule forecast to stay below the limits minus the margin
+
+        Raises
+        ------
+        ValueError
+            if no derating keeps the schedule below the limits (see derate)
+        """
+        if reorder:
+            schedule = self.reorder(schedule)
+        return self.derate(schedule)
+
+    def run(self, schedule, period = 1.):
+        """
+        Run a schedule on the light source, recording the status every period.
+
+        Parameters
+        ----------
+        schedule : list of (float, float)
+            (duration in seconds, intensity) steps, see plan; the steps at
+            intensity 0 are sent as an explicit zero intensity
+        period : float
+            time between two status records in seconds
+        """
+        for duration, intensity in schedule:
+            self.light.set_precise_intensity(intensity)
+            end = time.monotonic() + duration
+            while True:
+                self.record()
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(min(period, remaining))
@@ -0,0 +1,169 @@
+"""
+Timed command sequences for the MCLS Schott light sources
+"""
+import time
+import numpy as np
+from .Status import check_ack
+
+report_dtype = np.dtype([('deadline', 'f8'),
+                         ('sent', 'f8'),
+                         ('written', 'f8'),
+                         ('jitter', 'f8'),
+                         ('transmission', 'f8'),
+                         ])
+
+
+def _command(method, args):
+    # returns the command and the intensity it sets (None for on/off)
+    if method == 'set_on':
+        return 'L1', None
+    if method == 'set_off':
+        return 'L0', None
+    if method in ('set_intensity', 'set_precise_intensity'):
+        e, = args
+        if method == 'set_intensity':
+            if not 0<e<=1:
+                raise ValueError('intensity must be in the ]0, 1] range')
+            return 'I' + hex(int(e*255)), int(e*255)/255
+        if not 0<=e<=1:
+            raise ValueError('intensity must be in the [0, 1] range')
+        return 'IP' + hex(int(round(e*2047))), int(round(e*2047))/2047
+    raise ValueError('unknown method {!r}'.format(method))
+
+
+class CommandSequence(object):
+    """
+    Timeline of commands sent at absolute times of a monotonic clock.
+
+    The commands are encoded when they are added. When the sequence runs, the
+    thread sleeps until shortly before each deadline, then spins on the clock
+    and writes the command bytes as soon as the deadline is reached.
+    The serial port is held for the whole sequence; the replies, one per command,
+    are read in order once the last command is sent, and each one is checked
+    against its own command before the state of the light is updated.
+
+    Example
+    -------
+    seq = CommandSequence(light)
+    t0 = time.monotonic() + 0.1
+    seq.add(t0, 'set_on')
+    seq.add(t0 + 0.02, 'set_intensity', 0.3)
+    seq.add(t0 + 0.5, 'set_off')
+    report = seq.run()
+    """
+    def __init__(self, light, clock = time.monotonic, spin = 0.002):
+        """
+        Command sequence creator
+
+        Parameters
+        ----------
+        light : MCLS_Light
+            light source receiving the commands
+        clock : callable
+            monotonic clock giving the deadlines, in seconds
+        spin : float
+            time before each deadline spent spinning on the clock instead of
+            sleeping, in seconds (larger on systems with a coarse sleep, e.g. 0.016 on Windows)
+        """
+        self.light = light
+        self.clock = clock
+        self.spin = spin
+        self.timeline = []
+        self.report = None
+
+    def add(self, t, method, *args):
+        """
+        Add a command to the timeline.
+
+        Parameters
+        ----------
+        t : float
+            absolute time of the command on the clock of the sequence
+        method : string
+            'set_on', 'set_off', 'set_intensity' or 'set_precise_intensity'
+        *args
+            intensity for the set_intensity and set_precise_intensity methods
+
+        Raises
+        ------
+        ValueError
+            if the method is unknown or the intensity is out of range
+        """
+        command, setpoint = _command(method, args)
+        self.timeline.append((t, command, setpoint, self.light.encode(command)))
+
+    def clear(self):
+        """
+        Remove all the commands of the timeline.
+        """
+        self.timeline = []
+
+    def run(self):
+        """
+        Send the commands at their deadlines. Blocks until the last one is sent.
+
+        Returns
+        -------
+        report : numpy.ndarray
+            array of dtype report_dtype with, for each command in time order,
+            the deadline, the clock just before (sent) and after (written) the write,
+            the jitter (sent - deadline) and the transmission time of the bytes
+            on the serial line, in seconds
+
+        Raises
+        ------
+        ValueError
+            if some commands were not acknowledged by the controller (the
+            report of the run is still kept in self.report)
+        """
+        timeline = sorted(self.timeline, key=lambda c: c[0])
+        report = np.zeros(len(timeline), dtype=report_dtype)
+        bits_per_byte = 1 + self.light.bytesize + self.light.stopbits
+        ser = self.light.ser
+        clock = self.clock
+        with self.light.lock:
+            for i, (deadline, command, setpoint, input_bytes) in enumerate(timeline):
+                delay = deadline - clock() - self.spin
+                if delay > 0:
+                    time.sleep(delay)
+                while clock() < deadline:
+                    pass
+                sent = clock()
+                ser.write(input_bytes)
+                written = clock()
+                report[i] = (deadline, sent, written, sent - deadline,
+                             len(input_bytes)*bits_per_byte/self.light.baudrate)
+            errors = []
+            for deadline, command, setpoint, input_bytes in timeline:
+                answer = self.light.read()
+                try:
+                    check_ack(command, answer)
+                except ValueError as e:
+                    errors.append(str(e))
+                    continue
+                if setpoint is not None:
+                    self.light.setpoint = setpoint
+                else:
+                    self.light.on = command == 'L1'
+        self.report = report
+        if errors:
+            raise ValueError('{} command(s) not acknowledged: {}'.format(len(errors), '; '.join(errors)))
+        return report
+
+    @property
+    def jitter(self):
+        """
+        Jitter statistics of the last run.
+
+        Returns
+        -------
+        jitter : dict
+            mean, std and max of the jitter in seconds
+        """
+        if self.report is None or len(self.report) == 0:
+            return None
+        jitter = self.report['jitter']
+        return {'mean': float(jitter.mean()),
+                'std': float(jitter.std()),
+                'max': float(jitter.max()),
+                }
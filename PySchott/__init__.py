@@ -3,5 +3,16 @@ Driver for the MCLS Schott light sources using USB or RS232 COM ports
 """
 __version__ = '1.0.0'
 from .PySchott import MCLS_Light, KL_Light
+from .Status import MCLS_Status, ControlSource, ControlLockout
+from .Controller import IntensityController
+from .Sweep import calibration_table
+from .Thermal import ThermalScheduler
+from .Remote import LightServer, RemoteLight
+from .Timeline import CommandSequence
+from .Link_Watchdog import Watchdog
 from .Pyqt_App import LightControl
-from .Pyqt_Widget import LightWidget
\ No newline at end of file
+from .Pyqt_Widget import LightWidget
+try:
+    from .Jupyter_Widget import LightPanel
+except ImportError: # ipywidgets is only needed in notebooks
+    pass
@@ -0,0 +1,103 @@
+import threading
+import pytest
+from PySchott import LightServer, RemoteLight
+from PySchott.Remote import RemoteError, METHOD_NOT_FOUND, INVALID_PARAMS, DEVICE_ERROR
+from PySchott.Simulator import SimulatedLight
+
+
+@pytest.fixture
+def server():
+    light = SimulatedLight(latency = 0.05)
+    server = LightServer(light, port = 0)
+    server.start()
+    yield server
+    server.stop()
+    light.device.close()
+
+
+def connect(server):
+    host, port = server.address
+    return RemoteLight(host, port)
+
+
+def test_round_trip(server):
+    remote = connect(server)
+    device = server.light.device
+    remote.set_on()
+    remote.set_precise_intensity(0.5)
+    assert device.on
+    assert device.level == 1024
+    assert remote.serial_number == 1
+    assert remote.precise_intensity == pytest.approx(1024/2047)
+    status = remote.status
+    assert status.LED_output_enable
+    assert status.board_temperature == pytest.approx(30.)
+    remote.set_off()
+    assert not device.on
+    # every reply was read, none is left for the next query
+    assert not device._replies
+    remote.close()
+
+
+def test_batch(server):
+    remote = connect(server)
+    results = remote.batch(['set_on', ('set_precise_intensity', [0.25]),
+                            'precise_intensity', ('query_value', ['BT?'])])
+    assert results[2] == pytest.approx(512/2047)
+    assert results[3] == pytest.approx(30.)
+    assert server.light.device.log[-4:] == ['L1', 'IP0x200', 'IP?', 'BT?']
+    remote.close()
+
+
+def test_coalescing(server):
+    clients = [connect(server) for i in range(8)]
+    barrier = threading.Barrier(len(clients))
+    results = []
+
+    def poll(remote):
+        barrier.wait()
+        results.append(remote.board_temperature)
+
+    threads = [threading.Thread(target=poll, args=(c,)) for c in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [pytest.approx(30.)]*len(clients)
+    assert server.coalesced > 0
+    assert server.reads + server.coalesced == len(clients)
+    assert server.light.device.log.count('BT?') == server.reads
+    for c in clients:
+        c.close()
+
+
+def test_errors(server, monkeypatch):
+    remote = connect(server)
+    with pytest.raises(RemoteError) as e:
+        remote.call('close')
+    assert e.value.code == METHOD_NOT_FOUND
+    with pytest.raises(RemoteError) as e:
+        remote.call('set_on', 1)
+    assert e.value.code == INVALID_PARAMS
+    with pytest.raises(RemoteError) as e:
+        remote.call('set_intensity', 'high')
+    assert e.value.code == INVALID_PARAMS
+    for command in ('XX?', 'L1', 'K3'):
+        with pytest.raises(RemoteError) as e:
+            remote.query_value(command)
+        assert e.value.code == INVALID_PARAMS
+        assert command not in server.light.device.log
+    assert not server.light.device.on
+    with pytest.raises(ValueError):
+        server.light.query_value('L1')
+    assert 'L1' not in server.light.device.log
+
+    def broken(command):
+        raise AttributeError('serial port gone')
+
+    # errors raised by the light source are device errors, whatever their type
+    monkeypatch.setattr(server.light, 'query', broken)
+    with pytest.raises(RemoteError) as e:
+        remote.set_on()
+    assert e.value.code == DEVICE_ERROR
+    remote.close()
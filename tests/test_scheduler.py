@@ -0,0 +1,100 @@
+import time
+from concurrent.futures import CancelledError
+import pytest
+from PySchott import MCLS_Status
+from PySchott.Scheduler import CommandScheduler, Priority
+from PySchott.Simulator import SimulatedLight
+
+
+@pytest.fixture
+def light():
+    light = SimulatedLight(latency = 0.002)
+    light.set_on()
+    yield light
+    light.stop_scheduler()
+    light.device.close()
+
+
+def test_telemetry_share():
+    light = SimulatedLight()
+    for share in (0, -0.5, 1.5):
+        with pytest.raises(ValueError):
+            CommandScheduler(light, share)
+    light.device.close()
+
+
+def test_costs(light):
+    scheduler = CommandScheduler(light)
+    assert scheduler.command_bytes == len(light.encode('IP0x7ff'))
+    assert scheduler.reply_bytes('Q') == len('&qSCHOTT Microscopy Light Source (MC-LS)\r')
+    assert scheduler.reply_bytes('IP0x400') == len('&ip0x400\r')
+
+
+def test_safety_first(light):
+    scheduler = light.start_scheduler(telemetry_share = 0.1)
+    log = light.device.log
+    start = len(log)
+    # hold the link while the telemetry burst and the switch off are queued
+    with light.lock:
+        futures = [scheduler.submit(c) for c in MCLS_Status.commands]
+        off = scheduler.submit('L0')
+    assert off.result() == '&l0'
+    sent = log[start:]
+    # at most the telemetry query taken before the lock was released goes first
+    assert sent.index('L0') <= 1
+    assert [f.result() for f in futures]
+    assert scheduler.metrics['SAFETY']['sent'] == 1
+
+
+def test_safety_cancels_control(light):
+    scheduler = light.start_scheduler()
+    log = light.device.log
+    start = len(log)
+    with light.lock:
+        first = scheduler.submit('BT?')
+        on = scheduler.submit('L1')
+        intensity = scheduler.submit('IP0x400')
+        off = scheduler.submit('L0')
+        later = scheduler.submit('IP0x200')
+    assert off.result() == '&l0'
+    for future in (on, intensity):
+        with pytest.raises(CancelledError):
+            future.result()
+    assert later.result() == '&ip0x200'
+    assert first.result() == '&bt30.0'
+    sent = [c for c in log[start:] if c != 'BT?']
+    # a control command submitted after the safety one is not cancelled
+    assert sent == ['L0', 'IP0x200']
+    assert not light.device.on
+    assert light.device.level == 0x200
+    assert scheduler.metrics['cancelled'] == 2
+
+
+def test_deduplication(light):
+    scheduler = light.start_scheduler()
+    with light.lock:
+        futures = [scheduler.submit(c) for c in ('LT?', 'BT?', 'BT?', 'BT?', 'IP0x100', 'IP0x100')]
+    assert futures[2] is futures[1] or futures[3] is futures[2]
+    assert futures[4] is not futures[5]
+    assert [f.result() for f in futures][1:4] == ['&bt30.0']*3
+    assert scheduler.metrics['deduplicated'] >= 1
+    assert light.device.log.count('IP0x100') == 2
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_dispatcher_death(light):
+    scheduler = light.start_scheduler()
+
+    def broken(now):
+        raise RuntimeError('clock failure')
+
+    with light.lock:
+        scheduler._refill = broken
+        futures = [scheduler.submit(c) for c in ('BT?', 'LT?', 'IP0x100')]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout = 1)
+    scheduler._thread.join(1)
+    assert isinstance(scheduler.error, RuntimeError)
+    with pytest.raises(RuntimeError):
+        light.query('BT?')
@@ -0,0 +1,14 @@
+from PySchott import MCLS_Status
+from PySchott.Simulator import SimulatedLight
+
+
+def test_array_round_trip():
+    light = SimulatedLight()
+    light.set_on()
+    light.set_precise_intensity(0.3)
+    statuses = [light.status, light.status]
+    records = MCLS_Status.to_array(statuses)
+    assert records.dtype == MCLS_Status.dtype
+    assert MCLS_Status.from_array(records) == statuses
+    assert MCLS_Status.from_array(statuses[0].to_record()) == statuses[:1]
+    light.device.close()
@@ -0,0 +1,42 @@
+import pytest
+from PySchott import calibration_table
+from PySchott.Simulator import SimulatedLight
+
+
+class InterruptedLight(SimulatedLight):
+    # raises after a number of reads, as a KeyboardInterrupt in the middle of a batch
+    reads_left = None
+
+    def read(self):
+        if self.reads_left is not None:
+            if self.reads_left == 0:
+                self.reads_left = None
+                raise RuntimeError('interrupted')
+            self.reads_left -= 1
+        return super().read()
+
+
+def test_sweep():
+    light = SimulatedLight()
+    light.set_precise_intensity(0.2)
+    result = light.sweep(bits = 8, levels = [1, 128, 255])
+    assert list(result['intensity']) == pytest.approx([1/255, 128/255, 1.], abs = 1/255)
+    assert result['LED_heatsink_temperature'][-1] == pytest.approx(25.)
+    assert light.precise_intensity == pytest.approx(0.2, abs = 1e-3)
+    assert len(calibration_table(result, 'intensity')) == 3
+    light.device.close()
+
+
+def test_interrupted_sweep():
+    light = InterruptedLight(latency = 0.005)
+    light.set_precise_intensity(0.2)
+    light.reads_left = 7
+    with pytest.raises(RuntimeError):
+        light.sweep(bits = 11, levels = range(1, 41), batch = 8)
+    # the intensity is restored and no stale reply is left for the next queries
+    assert light.device.level == round(0.2*2047)
+    assert light.board_temperature == pytest.approx(30.)
+    assert light.serial_number == 1
+    result = light.sweep(result = light.last_sweep)
+    assert list(result['precise_intensity']) == pytest.approx([l/2047 for l in range(1, 41)])
+    light.device.close()
@@ -0,0 +1,28 @@
+import warnings
+import numpy as np
+import pytest
+from PySchott.Status import MCLS_Status, ControlLockout, ControlSource
+from PySchott.Thermal import ThermalModel
+
+
+def status(t, intensity, heatsink, board):
+    return MCLS_Status(t, True, intensity, intensity, 51.4, 23., False, True,
+                       board, heatsink, 2518., 23.45, ControlLockout.NONE, ControlSource.USB)
+
+
+def test_forecast_flat_temperature():
+    # the heatsink relaxes towards 25 + 30*intensity, the board stays flat
+    model = ThermalModel()
+    T = 25.
+    for i in range(50):
+        intensity = 0.2 + 0.6*(i % 10 < 5)
+        model.add(status(float(i), intensity, T, 30.))
+        T += 0.05*(25. + 30.*intensity - T)
+    k3 = model.fit()[3]
+    assert k3[1] == 0.
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        t, T = model.forecast([2000.], [1.])
+    assert np.all(np.isfinite(T))
+    assert T[-1, 0] == pytest.approx(55., abs = 0.5)
+    assert T[-1, 1] == pytest.approx(30.)